@@ -1,20 +1,44 @@
-import pandas as pd
-import numpy as np
 import json
 import sys
 import os
 import time
 import pickle
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QLabel, QLineEdit,
                              QPushButton, QVBoxLayout, QWidget, QFileDialog,
                              QTextEdit, QSpinBox, QMessageBox)
 from PyQt5.QtCore import QTimer, QThread, pyqtSignal
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-import win32com.client as win32
+from openpyxl import load_workbook
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
 import socket
 
+# Excel file extensions handled by the uploader (matched case-insensitively)
+EXCEL_EXTS = ('.xlsx', '.xls', '.xlsm', '.xlsb')
+
+# Maximum rows per values().append request, keeping payloads bounded
+APPEND_CHUNK_ROWS = 10000
+
+
+class FolderEventHandler(FileSystemEventHandler):
+    """Pushes file create/modify events from the watched folder onto a queue."""
+
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.events.put(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.events.put(event.src_path)
+
+
 class WorkerThread(QThread):
     """Thread for handling the automatic upload process."""
     upload_successful = pyqtSignal(str)
@@ -29,118 +53,271 @@ class WorkerThread(QThread):
         self.service = service
         self.interval_seconds = interval_seconds
         self.running = True
+        self.events = queue.Queue()  # Filled by the filesystem watcher
+        # check_same_thread=False: the connection is opened here but used from run()
+        self.db = sqlite3.connect("uploaded_files.db", check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS uploaded_files (name TEXT PRIMARY KEY, mtime REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS row_hashes (h BLOB PRIMARY KEY)")
+        self.migrate_legacy_uploaded_files()
         self.uploaded_files = self.load_uploaded_files()  # Load saved timestamps
+        self._dirty = False       # True while timestamp records await a commit
+        self._last_probe = None   # monotonic time of the last connectivity check
+        self._online = False
 
     def is_connected(self):
-        """Check internet connectivity."""
+        """Check internet connectivity (DNS-only probe, cached per interval)."""
+        now = time.monotonic()
+        if self._last_probe is not None and now - self._last_probe < self.interval_seconds:
+            return self._online
         try:
-            socket.create_connection(("www.google.com", 80), timeout=5)
-            return True
+            socket.gethostbyname("sheets.googleapis.com")
+            self._online = True
         except OSError:
-            return False
-
-    def get_existing_google_sheets_data(self):
-        """Fetch existing data from Google Sheets."""
-        try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.gsheet_id,
-                range='DataGGsheet1!A1'
-            ).execute()
-            return result.get('values', [])  # Return existing data or empty list
-        except Exception as e:
-            self.upload_failed.emit(f"Error fetching Google Sheets data: {e}")
-            return []
+            self._online = False
+        self._last_probe = now
+        return self._online
 
     def get_excel_data(self, file_path):
-        """Reads Excel file and extracts data as a list of rows, replacing NaN values."""
+        """Reads Excel file and extracts data as a list of rows, replacing empty cells.
+
+        Picks the reader by extension: openpyxl for .xlsx/.xlsm, xlrd for
+        legacy .xls (openpyxl cannot open it), pyxlsb for binary .xlsb.
+        """
+        ext = os.path.splitext(file_path)[1].lower()
         try:
-            df = pd.read_excel(file_path, engine="openpyxl", header=None)
-            df = df.replace({np.nan: ""})  # Replace NaN with empty string
-            return df.values.tolist()
+            if ext == '.xls':
+                import xlrd
+                wb = xlrd.open_workbook(file_path, on_demand=True)
+                sheet = wb.sheet_by_index(0)
+                rows = [[cell.value for cell in row] for row in sheet.get_rows()]
+                wb.release_resources()
+            elif ext == '.xlsb':
+                from pyxlsb import open_workbook
+                with open_workbook(file_path) as wb:
+                    with wb.get_sheet(1) as sheet:
+                        rows = [[("" if cell.v is None else cell.v) for cell in row]
+                                for row in sheet.rows()]
+            else:
+                wb = load_workbook(file_path, read_only=True, data_only=True)
+                ws = wb.active
+                rows = [[("" if value is None else value) for value in row]
+                        for row in ws.iter_rows(values_only=True)]
+                wb.close()
+            return rows
         except Exception as e:
             self.upload_failed.emit(f"Error reading file '{file_path}': {e}")
             return []
 
-    def load_uploaded_files(self):
-        """Loads previously uploaded file metadata (filename -> last modified timestamp)."""
-        if os.path.exists("uploaded_files.pkl"):
+    def migrate_legacy_uploaded_files(self):
+        """One-time import of the old uploaded_files.pkl into the database.
+
+        Without this, a deployment upgrading from the pickle store would start
+        empty and re-upload every workbook already in the folder.
+        """
+        if not os.path.exists("uploaded_files.pkl"):
+            return
+        if self.db.execute("SELECT 1 FROM uploaded_files LIMIT 1").fetchone():
+            return  # Table already populated; the pickle is stale
+        try:
             with open("uploaded_files.pkl", "rb") as f:
-                return pickle.load(f)
-        return {}
+                legacy = pickle.load(f)
+            self.db.executemany("INSERT OR REPLACE INTO uploaded_files VALUES (?, ?)", legacy.items())
+            self.db.commit()
+            os.replace("uploaded_files.pkl", "uploaded_files.pkl.bak")
+        except Exception:
+            pass  # Unreadable pickle: start fresh, same as the old loader would
 
-    def save_uploaded_files(self):
-        """Saves uploaded file metadata to avoid redundant uploads."""
-        with open("uploaded_files.pkl", "wb") as f:
-            pickle.dump(self.uploaded_files, f)
+    def load_uploaded_files(self):
+        """Loads previously uploaded file metadata (filename -> last modified timestamp)."""
+        return dict(self.db.execute("SELECT name, mtime FROM uploaded_files"))
+
+    def save_uploaded_file(self, filename, mtime):
+        """Queues an uploaded file's timestamp; flush_uploaded_files commits it."""
+        self.db.execute("INSERT OR REPLACE INTO uploaded_files VALUES (?, ?)", (filename, mtime))
+        self._dirty = True
+
+    def filter_new_rows(self, rows, seen_hashes):
+        """Keeps only rows whose content hash hasn't been uploaded before.
+
+        The hash set lives in the state database, so duplicates are detected
+        without re-downloading the sheet contents. Returns (row, hash) pairs;
+        the hashes are stored only after the rows are actually appended.
+        seen_hashes dedups within the current scan.
+        """
+        fresh = []
+        for row in rows:
+            row_hash = blake2b(repr(row).encode(), digest_size=16).digest()
+            if row_hash in seen_hashes:
+                continue
+            if self.db.execute("SELECT 1 FROM row_hashes WHERE h = ?", (row_hash,)).fetchone():
+                continue
+            seen_hashes.add(row_hash)
+            fresh.append((row, row_hash))
+        return fresh
+
+    def flush_uploaded_files(self):
+        """Commits queued timestamp records, if any."""
+        if self._dirty:
+            self.db.commit()
+            self._dirty = False
 
     def run(self):
         self.upload_failed.emit("Worker thread started...")
-        while self.running:
-            if self.is_connected():
-                self.internet_connected.emit()
-                self.upload_failed.emit("Internet is connected. Scanning folder...")
 
-                if not (self.folder_path and self.gsheet_id and self.service):
-                    self.upload_failed.emit("Error: Folder path, Google Sheet ID, or service not initialized.")
-                    time.sleep(self.interval_seconds)
-                    continue
+        observer = Observer()
+        try:
+            observer.schedule(FolderEventHandler(self.events), self.folder_path)
+            observer.start()
+        except OSError as e:
+            # Stale folder from settings.json, or deleted/renamed before Start
+            self.upload_failed.emit(f"Error: Folder not found: {self.folder_path} ({e})")
+            self.upload_failed.emit("Worker thread stopped.")
+            return
+
+        try:
+            # Initial pass picks up files that were already in the folder
+            # before the watcher started.
+            self.scan_folder()
 
+            while self.running:
                 try:
-                    for filename in os.listdir(self.folder_path):
-                        if filename.endswith(('.xlsx', '.xls')):
-                            file_path = os.path.join(self.folder_path, filename)
-                            file_modified_time = os.path.getmtime(file_path)  # Get last modified timestamp
-
-                            # Check if file has already been uploaded
-                            if filename in self.uploaded_files and self.uploaded_files[filename] == file_modified_time:
-                                self.upload_failed.emit(f"Bỏ qua '{filename}': Đã tải lên google sheet (No modification).")
-                                continue  # Skip to the next file
-
-                            self.upload_failed.emit(f"Kiểm tra file mới: {filename}")
-
-                            # Read Excel data
-                            rngData = self.get_excel_data(file_path)
-                            if rngData:
-                                try:
-                                    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-                                    new_data = [[f"Uploaded on: {timestamp}"]] + rngData
-
-                                    # Read existing Google Sheets data
-                                    existing_data = self.get_existing_google_sheets_data()
-                                    filtered_data = [row for row in new_data if row not in existing_data]
-
-                                    if filtered_data:
-                                        self.service.spreadsheets().values().append(
-                                            spreadsheetId=self.gsheet_id,
-                                            valueInputOption='USER_ENTERED',
-                                            range='DataGGsheet1!A1',
-                                            body={'values': filtered_data}
-                                        ).execute()
-                                        
-                                        self.upload_successful.emit(f"File '{filename}' Tải lên vào {timestamp}")
-
-                                        # Save the new modification time
-                                        self.uploaded_files[filename] = file_modified_time
-                                        self.save_uploaded_files()
-
-                                    else:
-                                        self.upload_successful.emit(f"File '{filename}' contains only duplicate data. Skipping upload.")
-
-                                except Exception as e:
-                                    self.upload_failed.emit(f"Error sending file '{filename}' to Google Sheets: {e}")
-
-                except FileNotFoundError:
-                    self.upload_failed.emit(f"Error: Folder not found: {self.folder_path}")
-                except Exception as e:
-                    self.upload_failed.emit(f"An unexpected error occurred: {e}")
+                    # Sleep until the watcher reports a change; the timeout acts
+                    # as a heartbeat so connectivity is re-checked while idle.
+                    self.events.get(timeout=self.interval_seconds)
+                except queue.Empty:
+                    pass
+                else:
+                    # Coalesce a burst of events into a single scan
+                    while not self.events.empty():
+                        try:
+                            self.events.get_nowait()
+                        except queue.Empty:
+                            break
+
+                if self.running:
+                    self.scan_folder()
+        finally:
+            observer.stop()
+            observer.join()
 
-            else:
-                self.internet_disconnected.emit()
+        self.upload_failed.emit("Worker thread stopped.")
 
-            self.upload_failed.emit(f"Đợi {self.interval_seconds} giây để tiếp tục quét...")
-            time.sleep(self.interval_seconds)
+    def scan_folder(self):
+        """Runs one upload pass over the watched folder."""
+        if not self.is_connected():
+            self.internet_disconnected.emit()
+            return
 
-        self.upload_failed.emit("Worker thread stopped.")
+        self.internet_connected.emit()
+        self.upload_failed.emit("Internet is connected. Scanning folder...")
+
+        if not (self.folder_path and self.gsheet_id and self.service):
+            self.upload_failed.emit("Error: Folder path, Google Sheet ID, or service not initialized.")
+            return
+
+        # One formatted timestamp per scan cycle, reused for every header row
+        # and success message instead of calling strftime per file
+        scan_timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+
+        try:
+            pending = []  # (filename, mtime, path) of new/modified files
+
+            with os.scandir(self.folder_path) as entries:
+                for entry in entries:
+                    filename = entry.name
+                    if not filename.lower().endswith(EXCEL_EXTS):
+                        continue
+
+                    # Check if file has already been uploaded. The stat info is
+                    # cached from the directory read, so an unchanged file is
+                    # skipped before any path join or workbook open.
+                    file_modified_time = entry.stat().st_mtime
+                    if self.uploaded_files.get(filename) == file_modified_time:
+                        self.upload_failed.emit(f"Bỏ qua '{filename}': Đã tải lên google sheet (No modification).")
+                        continue  # Skip to the next file
+
+                    if not entry.is_file():
+                        continue
+
+                    self.upload_failed.emit(f"Kiểm tra file mới: {filename}")
+                    pending.append((filename, file_modified_time, entry.path))
+
+            batch_rows = []     # (row, hash) from every pending file; hash None for headers
+            pending_files = []  # (filename, mtime, end offset in batch_rows)
+            skipped_files = []  # (filename, mtime) of duplicate-only files
+            seen_hashes = set()
+
+            if pending:
+                # Overlap disk reads and zip decompression across files; only
+                # the Sheets API call below stays sequential (rate limits).
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    results = executor.map(lambda item: self.get_excel_data(item[2]), pending)
+                    for (filename, file_modified_time, _), rngData in zip(pending, results):
+                        if not rngData:
+                            continue
+
+                        fresh_rows = self.filter_new_rows(rngData, seen_hashes)
+                        if not fresh_rows:
+                            self.upload_successful.emit(f"File '{filename}' contains only duplicate data. Skipping upload.")
+                            skipped_files.append((filename, file_modified_time))
+                            continue
+
+                        batch_rows.append(([f"Uploaded on: {scan_timestamp}"], None))
+                        batch_rows.extend(fresh_rows)
+                        pending_files.append((filename, file_modified_time, len(batch_rows)))
+
+            # One append call per 10k-row chunk instead of one per file, so
+            # huge workbooks are never JSON-encoded as a single request body
+            if batch_rows:
+                appended = 0     # rows durably written and committed so far
+                files_done = 0   # pending_files entries already recorded
+                try:
+                    while appended < len(batch_rows):
+                        chunk = batch_rows[appended:appended + APPEND_CHUNK_ROWS]
+                        self.service.spreadsheets().values().append(
+                            spreadsheetId=self.gsheet_id,
+                            valueInputOption='RAW',
+                            range='DataGGsheet1!A1',
+                            body={'values': [row for row, _ in chunk]}
+                        ).execute()
+
+                        # The chunk is in the sheet; commit its row hashes and
+                        # any file bookkeeping it completed right away, so a
+                        # failure on a later chunk can't re-append these rows.
+                        self.db.executemany("INSERT OR IGNORE INTO row_hashes VALUES (?)",
+                                            [(h,) for _, h in chunk if h is not None])
+                        appended += len(chunk)
+                        while files_done < len(pending_files) and pending_files[files_done][2] <= appended:
+                            filename, file_modified_time, _ = pending_files[files_done]
+                            self.upload_successful.emit(f"File '{filename}' Tải lên vào {scan_timestamp}")
+
+                            # Save the new modification time
+                            self.uploaded_files[filename] = file_modified_time
+                            self.save_uploaded_file(filename, file_modified_time)
+                            files_done += 1
+                        self.db.commit()
+                        self._dirty = False
+
+                except Exception as e:
+                    # Discard anything staged past the last committed chunk so
+                    # the remaining rows are retried once the append can succeed
+                    self.db.rollback()
+                    self._dirty = False
+                    self.upload_failed.emit(f"Error sending files to Google Sheets: {e}")
+
+            # Duplicate-only files carry no new rows, so their bookkeeping is
+            # independent of the appends above. Stage it after the append
+            # try/except and commit straight away, so a rollback there can
+            # never leave the in-memory dict ahead of the database.
+            for filename, file_modified_time in skipped_files:
+                self.uploaded_files[filename] = file_modified_time
+                self.save_uploaded_file(filename, file_modified_time)
+            self.flush_uploaded_files()
+
+        except FileNotFoundError:
+            self.upload_failed.emit(f"Error: Folder not found: {self.folder_path}")
+        except Exception as e:
+            self.upload_failed.emit(f"An unexpected error occurred: {e}")
 
 
 
@@ -157,6 +334,8 @@ class ExcelToSheetsApp(QMainWindow):
         self.client_secret_file = ""
         self.service = None
         self.upload_interval_minutes = 5  # Default interval
+        self._timestamp_second = None  # Cache for update_notification timestamps
+        self._timestamp_text = ""
 
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
@@ -203,6 +382,8 @@ class ExcelToSheetsApp(QMainWindow):
         self.layout.addWidget(self.notification_label)
         self.notification_panel = QTextEdit()
         self.notification_panel.setReadOnly(True)
+        # Cap the log so multi-day runs don't accumulate unbounded text
+        self.notification_panel.document().setMaximumBlockCount(500)
         self.layout.addWidget(self.notification_panel)
 
         # Start Button
@@ -272,6 +453,13 @@ class ExcelToSheetsApp(QMainWindow):
             self.update_notification("Thất bại tạo Google Sheets service. kiểm tra credentials.")
 
     def create_service(self, client_secret_file, api_name, api_version, scopes):
+        # Imported here so the GUI window appears before these heavy modules load
+        from googleapiclient.discovery import build
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        import google_auth_httplib2
+        import httplib2
+
         cred = None
         pickle_file = f'token_{api_name}_{api_version}.pickle'
         
@@ -290,7 +478,10 @@ class ExcelToSheetsApp(QMainWindow):
                 pickle.dump(cred, token)
         
         try:
-            service = build(api_name, api_version, credentials=cred)
+            # One AuthorizedHttp for the service lifetime, so the TCP/TLS
+            # session is reused across API calls instead of re-handshaking
+            authed_http = google_auth_httplib2.AuthorizedHttp(cred, http=httplib2.Http(timeout=30))
+            service = build(api_name, api_version, http=authed_http)
             return service
         except Exception as e:
             self.update_notification(f"Unable to connect: {e}")
@@ -342,8 +533,12 @@ class ExcelToSheetsApp(QMainWindow):
 
 
     def update_notification(self, message):
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        log_message = f"[{timestamp}] {message}"
+        # strftime at most once per second; bursts of signals reuse the cache
+        now = int(time.time())
+        if now != self._timestamp_second:
+            self._timestamp_second = now
+            self._timestamp_text = time.strftime('%Y-%m-%d %H:%M:%S')
+        log_message = f"[{self._timestamp_text}] {message}"
         self.notification_panel.append(log_message)
         self.notification_panel.ensureCursorVisible()
 